@@ -530,6 +530,8 @@ def check_knot_cosmetic(knot, use_HFK = True, tries=10, verbose=3):
     
     # Let's be liberal in what we accept
     name, M, K = name_manifold_and_link(knot, verbose=verbose)
+    # Cached data about fillings of other knots is no use to us.
+    gt.clear_caches()
 
     # But not too liberal
     assert gt.is_knot_manifold(M)
@@ -149,7 +149,7 @@ def find_systole_short_slopes(M, tries=8, verbose=4):
             verbose_print(verbose, 8, [M.name(), s, 'known exceptional or unidentified slope'])
             continue
 
-        assert gt.is_hyperbolic_filling(M, s, m, l, tries, verbose)
+        assert gt.is_hyperbolic_filling(M, s, m, l, tries, verbose, N=Q)
         # All slopes not in M.slopes_exclude are necessarily hyperbolic.
         add_to_dict_of_sets(M.slopes_hyp, hom_hash, s)
             
@@ -701,6 +701,8 @@ def find_common_fillings(M, N, ExcludeS3 = False, tries=8, verbose=4):
     
     # Be liberal in what you accept
     M, N = mfds = [snappy.Manifold(P) for P in mfds]
+    # Cached data about fillings of other manifolds is no use to us.
+    gt.clear_caches()
     
     # but not too liberal.
     for P in mfds:
@@ -820,6 +822,8 @@ def check_cosmetic(M, use_BoyerLines=True, check_chiral=False, tries=8, verbose=
     
     # Be liberal in what you accept
     M = snappy.Manifold(M)
+    # Cached data about fillings of other manifolds is no use to us.
+    gt.clear_caches()
 
     # but not too liberal.
     if not M.num_cusps() == 1:
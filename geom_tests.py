@@ -28,6 +28,107 @@ from sage.modules.free_module_element import vector
 from sage.rings.real_mpfr import RR
 from sage.rings.real_mpfi import RIF
 
+from functools import lru_cache
+import numpy as np
+
+
+# caches
+
+# The same filled manifold is often examined several times: across
+# passes in get_S3_slope_hyp, and across the various routines that call
+# is_hyperbolic_filling.  The following wrappers remember the answers
+# of the expensive SnapPy/Regina/GAP calls, keyed by an oriented,
+# decorated isosig (which records the Dehn fillings).
+
+
+def filled_isosig(N):
+    """
+    Given a snappy Manifold N, possibly with filled cusps, returns a
+    string that determines N (including its fillings and orientation).
+    """
+    return N.triangulation_isosig(decorated = True, ignore_orientation = False)
+
+
+@lru_cache(maxsize = 1024)
+def _cached_group_type(isosig, tries, verbose):
+    N = snappy.Manifold(isosig)
+    return ft.is_exceptional_due_to_fundamental_group(N, tries, verbose)
+
+
+@lru_cache(maxsize = 1024)
+def _cached_regina_name(isosig):
+    return dunfield.regina_name(isosig)
+
+
+@lru_cache(maxsize = 1024)
+def _cached_is_hyperbolic(isosig, tries, verbose):
+    return dunfield.is_hyperbolic(snappy.Manifold(isosig), tries, verbose)
+
+
+def group_type(N, tries, verbose):
+    """
+    Cached version of ft.is_exceptional_due_to_fundamental_group.
+    """
+    return _cached_group_type(filled_isosig(N), tries, verbose)
+
+
+def regina_name(N):
+    """
+    Cached version of dunfield.regina_name.
+    """
+    return _cached_regina_name(filled_isosig(N))
+
+
+def is_hyperbolic(N, tries, verbose):
+    """
+    Cached version of dunfield.is_hyperbolic.
+    """
+    return _cached_is_hyperbolic(filled_isosig(N), tries, verbose)
+
+
+# Positive triangulations are stored as the manifolds found (so the
+# positive solution is kept), and every caller gets its own copy.  Keys
+# are (isosig, tries).  The dictionary is emptied when it grows past
+# POSITIVE_CACHE_SIZE entries, to keep memory bounded.
+
+POSITIVE_CACHE_SIZE = 512
+_positive_triangulations = {}
+
+
+def positive_triangulation(M, tries, verbose = 2):
+    """
+    Cached version of dunfield.find_positive_triangulation.  Returns a
+    copy of the positively oriented manifold found, or None if no
+    positive triangulation was found.
+    """
+    key = (filled_isosig(M), tries)
+    if key in _positive_triangulations:
+        X = _positive_triangulations[key]
+        if X == None:
+            return None
+        X = X.copy()
+        if dunfield.all_positive(X):
+            return X
+        verbose_print(verbose, 10, [M, 'cached triangulation is no longer positive'])
+    if len(_positive_triangulations) >= POSITIVE_CACHE_SIZE:
+        _positive_triangulations.clear()
+    X = dunfield.find_positive_triangulation(M, tries = tries, verbose = verbose)
+    _positive_triangulations[key] = None if X == None else X.copy()
+    return X
+
+
+def clear_caches():
+    """
+    Empties the caches above.  Call this once per top-level manifold
+    (or knot), to keep memory usage bounded.
+    """
+    _cached_group_type.cache_clear()
+    _cached_regina_name.cache_clear()
+    _cached_is_hyperbolic.cache_clear()
+    _cusp_invariants.clear()
+    _positive_triangulations.clear()
+    rt.clear_caches()
+
 
 # sanity checks
 
@@ -87,7 +188,7 @@ def is_knot_manifold(M):
         return False    
     if not M.is_orientable():
         return False
-    if M.homology().__repr__() != 'Z': 
+    if M.homology().elementary_divisors() != [0]: # that is, H_1(M) = Z
         return False
     return True
 
@@ -109,7 +210,7 @@ def sanity_check_cusped(M, tries=10, verbose=3):
         return (M, None)
         
     elif sol_type == 'contains negatively oriented tetrahedra':
-        X = dunfield.find_positive_triangulation(M, tries=tries, verbose=verbose)
+        X = positive_triangulation(M, tries, verbose)
         if X == None:
             verbose_print(verbose, 5, [M, 'positive triangulation fail'])
             return (None, 'positive triangulation fail')
@@ -144,10 +245,20 @@ def sanity_check_cusped(M, tries=10, verbose=3):
 
 # cusp utilities
 
+# alg_int and preferred_rep are deliberately plain Python.  Some callers
+# still hand them Sage Integers or vectors (eg from change of basis
+# matrices), which a JIT-compiled kernel would reject, and for a single
+# 2x2 determinant the call overhead of a compiled function exceeds the
+# work done.  Where many slopes are handled at once, use NumPy instead;
+# see find_short_slopes and get_S3_slope_hyp.
+
 
 def alg_int(u, v):
     """
     Given two slopes, compute their algebraic intersection number.
+    Slopes may be any integer-like pairs (Python ints, Sage Integers,
+    Sage vectors).  find_short_slopes supplies Python ints, which
+    keeps the arithmetic cheap in the loops over short slopes.
     """
     a, b = u
     c, d = v
@@ -157,6 +268,7 @@ def alg_int(u, v):
 def preferred_rep(t):
     """
     Find the preferred representative of a slope in QP^1.
+    As with alg_int, the slope may be any integer-like pair.
     """
     a, b = t
     out = (a,b)
@@ -181,14 +293,13 @@ def a_shortest_lattice_point_on_line(point, direction, m, l):
     # becomes horizontal, and the lattice points of L' are now distance one
     # apart.  The points of L' now have the form (a*m + b*l - k(c*m +
     # d*l))/(c*m + d*l), for k an integer.  We must minimise the real
-    # part.
-    real_part = ((a*m + b*l)/(c*m + d*l)).real()
-    rounded_part = real_part.round() # not the floor, not the ceiling...
-    left, right = rounded_part.endpoints()
-    # if left and right are separated (say, because real_part contains
-    # a half integer) we could give up, but instead:
-    # Old: assert 0.0 <= right - left < 0.1 
-    k = int(left)
+    # part.  A floating point approximation gets us to within one of
+    # the best k, and then we compare the neighbours directly.
+    point_hol = a*m + b*l
+    direction_hol = c*m + d*l
+    approx = float((point_hol/direction_hol).real().center())
+    k = int(round(approx))
+    k = min((k-1, k, k+1), key = lambda j: abs(point_hol - j*direction_hol).center())
     return preferred_rep((a - k*c, b - k*d))
 
 
@@ -200,21 +311,34 @@ def shortest_complement(t, m, l):
     """
     c, d = t # second slope
     _, a, b = xgcd(d, c) # first slope
-    b = -b
+    a, b = int(a), -int(b)
     assert a*d - b*c == 1
     return a_shortest_lattice_point_on_line((a, b), (c, d), m, l)
 
 
+# Cusp invariants, keyed by filled_isosig(M).  The values are computed
+# from M itself, so that the caller's solution is used.
+
+CUSP_CACHE_SIZE = 1024
+_cusp_invariants = {}
+
+
 def cusp_invariants(M):
     """
     Given a snappy manifold with one cusp, returns the holonomies of
     the current meridian and longitude, and also the square root of
-    the area.
+    the area.  The answer is cached, so repeated calls are cheap.
     """
-    # Note - this uses the current framing, whatever it is
-    [(m,l)] = M.cusp_translations(verified = True, bits_prec = 100)
-    norm_fac = sqrt(l * m.imag())
-    return m, l, norm_fac
+    # Note - this uses the current framing, whatever it is.  The
+    # decorated isosig records the framing, so the cache respects it.
+    key = filled_isosig(M)
+    if key not in _cusp_invariants:
+        if len(_cusp_invariants) >= CUSP_CACHE_SIZE:
+            _cusp_invariants.clear()
+        [(m,l)] = M.cusp_translations(verified = True, bits_prec = 100)
+        norm_fac = sqrt(l * m.imag())
+        _cusp_invariants[key] = (m, l, norm_fac)
+    return _cusp_invariants[key]
 
 
 # Get a list of short slopes
@@ -262,22 +386,42 @@ def find_short_slopes(M, len_cutoff=None, normalized=False, tries=10, verbose=3)
         # Agol's Lemma says: find the next prime p, then the number of slopes is at most  p + 1.
         verbose_print(verbose, 12, [M, 'expecting at most', slopes_expected, 'slopes of length less than', len_cutoff])
 
-    prec = 40 # note the magic number 40.  Fix.
+    # Enumerate the candidate slopes at machine precision.  This is
+    # cheap, and lets us throw away the long slopes that the verified
+    # computation only reports because its intervals are wide.  Slopes
+    # of length less than len_cutoff satisfy
+    # |p| <= len_cutoff*|l|/Area and |q| <= len_cutoff*|m|/Area.
+    [(m0, l0)] = M.cusp_translations()
+    m0, l0 = complex(m0), complex(l0)
+    area = abs((m0.conjugate() * l0).imag)
+    cutoff = float(RIF(len_cutoff).upper())
+    p_max = int(ceil(cutoff * abs(l0) / area))
+    q_max = int(ceil(cutoff * abs(m0) / area))
+    P, Q = np.meshgrid(np.arange(0, p_max + 1), np.arange(-q_max, q_max + 1))
+    lengths = np.abs(P*m0 + Q*l0)
+    mask = (lengths < 1.05 * cutoff) & (np.gcd(P, Q) == 1)
+    candidates = set(preferred_rep((int(p), int(q))) for p, q in zip(P[mask], Q[mask]))
+    verbose_print(verbose, 12, [M, len(candidates), 'candidate slopes found numerically'])
+
+    # Now verify.  We only raise the precision if SnapPy fails outright.
+    slopes = None
+    prec = 80 # note the magic number 80.  Fix.
     for i in range(tries):
-        prec = prec * 2
         try:
             slopes = M.short_slopes(len_cutoff, verified = True, bits_prec=prec)[0]
-            if len(slopes) > slopes_expected:
-                # Accuracy is too low
-                continue
-            else:
-                verbose_print(verbose, 12, [M, 'managed to find', len(slopes), 'short slopes at precision', prec])
-                break
+            verbose_print(verbose, 12, [M, 'managed to find', len(slopes), 'short slopes at precision', prec])
+            break
         except ValueError:
             verbose_print(verbose, 10, [M, 'failed to find short slopes at precision', prec])
-            
-    slopes = [preferred_rep(s) for s in slopes]
-    return set(slopes)
+            prec = prec * 2
+    if slopes == None:
+        raise ValueError('failed to find short slopes on ' + str(M))
+
+    # SnapPy hands us Sage Integers; convert them once, here.
+    slopes = set(preferred_rep((int(a), int(b))) for a, b in slopes) & candidates
+    if len(slopes) > slopes_expected:
+        verbose_print(verbose, 0, [M, 'found', len(slopes), 'short slopes, more than', slopes_expected, 'expected'])
+    return slopes
 
 
 # unverified systole
@@ -303,20 +447,25 @@ def systole_with_covers(M, tries=10, verbose=3):
     for deg in range(1, 6):
         cov = M.covers(deg)
         for N in cov: 
+            # Randomize along a chain, skipping triangulations we have
+            # already tried.
+            isosigs = set()
             for i in range(retriang_attempts): # that looks like a magic number... 
-                for j in range(i):
-                    N.randomize() # This should probably be done with isosigs.
-                try:
-                    sys = systole(N, verbose = verbose)
-                    verbose_print(verbose, 10, ['systole of', deg, 'fold cover', N, 'is at least', sys])
-                    return (sys/deg)
-                except:
-                    sys = None
+                if i > 0:
+                    N.randomize()
+                sig = N.triangulation_isosig()
+                if sig in isosigs:
+                    continue
+                isosigs.add(sig)
+                sys = systole(N, verbose = verbose)
+                if sys == None:
                     verbose_print(verbose, 10, [N, 'systole failed on attempt', i])
+                    continue
+                verbose_print(verbose, 10, ['systole of', deg, 'fold cover', N, 'is at least', sys])
+                return (sys/deg)
 
-    if sys == None:
-        verbose_print(verbose, 6, [M, 'systole fail'])
-        return None
+    verbose_print(verbose, 6, [M, 'systole fail'])
+    return None
 
 
 def systole_with_tries(M, tries=10, verbose=3):
@@ -327,13 +476,11 @@ def systole_with_tries(M, tries=10, verbose=3):
     verbose_print(verbose, 12, [M, 'entering systole_with_tries'])
 
     # Before trying hard things, see if we get lucky.
-    try:
-        sys = systole(M, verbose=verbose)
+    sys = systole(M, verbose=verbose)
+    if sys != None:
         verbose_print(verbose, 10, [M, sys, 'systole computed on first attempt'])
         return sys
-    except:
-        sys = None
-        verbose_print(verbose, 10, [M, 'systole failed on first attempt'])
+    verbose_print(verbose, 10, [M, 'systole failed on first attempt'])
     
     # Build a database of isosigs
     N = snappy.Manifold(M)
@@ -347,17 +494,14 @@ def systole_with_tries(M, tries=10, verbose=3):
         
     for sig in isosigs:
         N = snappy.Manifold(sig)
-        try:
-            sys = systole(N, verbose=verbose)
+        sys = systole(N, verbose=verbose)
+        if sys != None:
             verbose_print(verbose, 10, [M, sys, 'systole computed from', sig])
             return sys
-        except:
-            sys = None
-            verbose_print(verbose, 10, [M, 'systole failed on', sig])
+        verbose_print(verbose, 10, [M, 'systole failed on', sig])
 
-    if sys == None:
-        verbose_print(verbose, 2, [M, 'systole fail'])
-        return None
+    verbose_print(verbose, 2, [M, 'systole fail'])
+    return None
 
 
 
@@ -367,11 +511,15 @@ def systole(M, verbose = 3):
     tries to compute the systole of M, non-rigorously (for now).
     We only care about systoles that are shorter than 0.15.
     
-    N.length_spectrum() might cause this routine to crash, so usage should be wrapped in a 'try'.
+    N.length_spectrum() sometimes fails; if so, we return None.
     """
     N = M.high_precision()
     verbose_print(verbose, 12, [M, "entering systole"])
-    spec = N.length_spectrum(0.15, full_rigor = True) # Not actually rigorous
+    try:
+        spec = N.length_spectrum(0.15, full_rigor = True) # Not actually rigorous
+    except (RuntimeError, ValueError, snappy.SnapPeaFatalError) as e:
+        verbose_print(verbose, 10, [M, "length spectrum failed", e])
+        return None
     verbose_print(verbose, 12, [M, "computed length spectrum"])
     if spec == []:
         return 0.15 # any systole larger than this gets ignored. 
@@ -493,6 +641,85 @@ def verified_systole_with_drilling(M, cutoff=None, bits_prec=300, tries=10, verb
 # Finding S3 slope
  
 
+# Status codes for the slopes examined by get_S3_slope_hyp.
+
+SLOPE_UNKNOWN = 0     # not yet examined
+SLOPE_HOMOLOGY = 1    # ruled out by homology
+SLOPE_S3 = 2          # the filling is S^3
+SLOPE_GROUP = 3       # nontrivial fundamental group
+SLOPE_HYPERBOLIC = 4  # the filling is hyperbolic
+SLOPE_COVER = 5       # the filling has a nontrivial cover
+SLOPE_NAMED = 6       # Regina names the filling, and it is not S^3
+SLOPE_HARD = 7        # none of the easy tests applies
+
+
+def slopes_with_status(slopes, status):
+    """
+    Given a dictionary of aligned arrays p, q, status (as built by
+    get_S3_slope_hyp), returns the list of slopes (p, q) with the
+    given status.
+    """
+    mask = slopes['status'] == status
+    return [(int(p), int(q)) for p, q in zip(slopes['p'][mask], slopes['q'][mask])]
+
+
+def _check_slope(M, r, verify_on, covers_on, tries, verbose):
+    """
+    Pass #2 of get_S3_slope_hyp, for a single slope r on the knot
+    manifold M: fundamental group, hyperbolic structure, covers, and
+    regina_name.  Returns one of the status codes above: SLOPE_S3 if
+    M(r) is the three-sphere, SLOPE_HARD if these tests cannot
+    decide, and otherwise the code of the test that ruled out S^3.
+    """
+    N = snappy.Manifold(M)
+    N.dehn_fill(r)
+
+    # Fundamental group
+    
+    exceptional, type_except = group_type(N, tries, verbose)
+    if type_except=='S3':
+        verbose_print(verbose, 5, [M, r, 'has trivial fundamental group'])
+        return SLOPE_S3
+    if type_except in ['S2 x S1', 'Free group', 'Lens', 'Has lens space summand']:
+        verbose_print(verbose, 10, [M, r, 'has nontrivial fundamental group'])
+        return SLOPE_GROUP
+        
+    # There are other exceptional types where the group may or may not be trivial.
+
+    # Verified hyperbolicity (skip this if we know the slope is exceptional)
+    if verify_on and not(exceptional):
+        structure_found = is_hyperbolic(N, 2*tries, verbose) # Nathan randomises for us.
+        if structure_found: 
+            verbose_print(verbose, 10, [M, r, 'hyperbolic structure found'])
+            return SLOPE_HYPERBOLIC
+
+    # Covers
+    # Checking degree 5 and 7 only seems to speed things up by 20%?
+    # So we try degree 5 first (degree 7 is too expensive to add), and
+    # stop at the first cover found.
+    if covers_on: 
+        verbose_print(verbose, 12, [M, r, 'Trying covers.'])
+        for i in (5, 2, 3, 4, 6):
+            verbose_print(verbose, 12, ['searching in degree', i])
+            if N.covers(i) != []: 
+            # Old comment: method='gap' is much faster
+            # New comment: probably not faster?
+                verbose_print(verbose, 10, [M, r, 'has a cover of degree', i])
+                return SLOPE_COVER
+
+    # Easy Regina: try to find the name in a lookup table.
+    verbose_print(verbose, 12, ['Trying Regina name search on', M, r])
+    name = regina_name(N)
+    if name=='S3':
+        verbose_print(verbose, 10, [M, r, 'is recognized as S3 triangulation'])
+        return SLOPE_S3
+    if name != None:
+        verbose_print(verbose, 10, [M, r, 'is recognized as', name])
+        return SLOPE_NAMED
+    
+    return SLOPE_HARD
+
+
 def get_S3_slope_hyp(M, verify_on=True, covers_on=True, regina_on=True, tries = 10, verbose=3): 
     """
     Given M, a hyperbolic knot manifold, returns the slope that gives
@@ -511,14 +738,14 @@ def get_S3_slope_hyp(M, verify_on=True, covers_on=True, regina_on=True, tries =
     N = snappy.Manifold(M)
     r=(1,0)
     N.dehn_fill(r)
-    exceptional, type_except = ft.is_exceptional_due_to_fundamental_group(N, tries, verbose)
+    exceptional, type_except = group_type(N, tries, verbose)
     if type_except=='S3':
         verbose_print(verbose, 5, ['Lucky guess:', M, r, 'has trivial fundamental group'])
         is_knot = True
         return r, is_knot, geometrically_easy, regina_easy
 
     # Now, try using geometry
-    M = dunfield.find_positive_triangulation(M, tries, verbose)
+    M = positive_triangulation(M, tries, verbose)
     
     if M.solution_type() != 'all tetrahedra positively oriented':
         verbose_print(verbose, 10, ['Bad triangulation:', M, M.solution_type()])
@@ -526,77 +753,37 @@ def get_S3_slope_hyp(M, verify_on=True, covers_on=True, regina_on=True, tries =
             
     six_theorem_length = 6.01 # All exceptionals shorter than this
     short_slopes_all = find_short_slopes(M, six_theorem_length, normalized=False, verbose=verbose)
-    short_slopes = []
-    short_slopes_hard = []
     long = M.homological_longitude()
     
     ## We take through passes through the list of slopes, ordered by speed.
     ## Pass #1: Homology (very fast)
     ## Pass #2: Fundamental group, covers, hyperbolic structure, regina_name
     ## Pass #3: Regina three-sphere recognition.
+    ## The slopes are stored as aligned arrays p, q, and status (one of
+    ## the SLOPE_* codes).  Pass #2 takes the slopes still marked
+    ## SLOPE_UNKNOWN, and pass #3 takes those marked SLOPE_HARD.
     
-    for r in short_slopes_all:
-        # Compute homology via intersection number with longitude
-        if abs(alg_int(long,r)) != 1:
-            verbose_print(verbose, 10, [M, r, 'ruled out by homology'])
-        else:
-            short_slopes.append(r)
-            
-    for r in short_slopes:
-        N = snappy.Manifold(M)
-        N.dehn_fill(r)
-
-        # Fundamental group
-        
-        exceptional, type_except = ft.is_exceptional_due_to_fundamental_group(N, tries, verbose)
-        if type_except=='S3':
-            verbose_print(verbose, 5, [M, r, 'has trivial fundamental group'])
+    pairs = np.array(list(short_slopes_all), dtype = np.int64).reshape(-1, 2)
+    slopes = {'p': pairs[:,0], 'q': pairs[:,1], 'status': np.full(len(pairs), SLOPE_UNKNOWN, dtype = np.uint8)}
+
+    # Compute homology via intersection number with longitude, for
+    # all slopes at once.
+    dets = int(long[0]) * slopes['q'] - int(long[1]) * slopes['p']
+    slopes['status'][np.abs(dets) != 1] = SLOPE_HOMOLOGY
+    verbose_print(verbose, 10, [M, slopes_with_status(slopes, SLOPE_HOMOLOGY), 'ruled out by homology'])
+
+    todo = np.flatnonzero(slopes['status'] == SLOPE_UNKNOWN)
+    short_slopes = [(int(slopes['p'][k]), int(slopes['q'][k])) for k in todo]
+    for k, r in zip(todo, short_slopes):
+        status = _check_slope(M, r, verify_on, covers_on, tries, verbose)
+        slopes['status'][k] = status
+        if status == SLOPE_S3:
             is_knot = True
             return r, is_knot, geometrically_easy, regina_easy
-        if type_except in ['S2 x S1', 'Free group', 'Lens', 'Has lens space summand']:
-            verbose_print(verbose, 10, [M, r, 'has nontrivial fundamental group'])
-            continue
-            
-        # There are other exceptional types where the group may or may not be trivial.
-
-        # Verified hyperbolicity (skip this if we know the slope is exceptional)
-        if verify_on and not(exceptional):
-            structure_found = dunfield.is_hyperbolic(N, 2*tries, verbose) # Nathan randomises for us.
-            if structure_found: 
-                verbose_print(verbose, 10, [M, r, 'hyperbolic structure found'])
-                continue
-
-        # Covers
-        # Checking degree 5 and 7 only seems to speed things up by 20%?
-        if covers_on: 
-            verbose_print(verbose, 12, [M, r, 'Trying covers.'])
-            cover_found = False
-            for i in range(2, 7):
-                verbose_print(verbose, 12, ['searching in degree', i])
-                if N.covers(i) != []: 
-                # Old comment: method='gap' is much faster
-                # New comment: probably not faster?
-                    cover_found = True
-                    verbose_print(verbose, 10, [M, r, 'has a cover of degree', i])
-                    break
-            if cover_found: continue
-
-        # Easy Regina: try to find the name in a lookup table.
-        verbose_print(verbose, 12, ['Trying Regina name search on', M, r])
-        name = dunfield.regina_name(N)
-        if name=='S3':
-            verbose_print(verbose, 10, [M, r, 'is recognized as S3 triangulation'])
-            is_knot = True   
-            return r, is_knot, geometrically_easy, regina_easy
-        if name != None:
-            verbose_print(verbose, 10, [M, r, 'is recognized as', name])
-            continue
-        
-        short_slopes_hard.append(r)
 
     # Now, try the hard stuff.
     regina_easy = False
-    for r in short_slopes_hard:
+    for r in slopes_with_status(slopes, SLOPE_HARD):
         N = snappy.Manifold(M)
         N.dehn_fill(r)
         if regina_on:
@@ -650,44 +837,59 @@ def get_S3_slope_hyp(M, verify_on=True, covers_on=True, regina_on=True, tries =
 # Geometry of fillings
 
 
-def is_hyperbolic_filling(M, s, m, l, tries, verbose):
+def is_hyperbolic_filling(M, s, m, l, tries, verbose, N=None):
     """
     Given a one-cusped manifold M (assumed hyperbolic), a slope s,
     and holonomies m, l of the meridian and longitude,
     try to determine if M(s) is hyperbolic or exceptional.  Returns
     True or False respectively, and returns None if we failed.
+
+    If the caller already has a copy of M(s), it may be passed in as N
+    to save making another one.  Note that N will be retriangulated.
     """
     verbose_print(verbose, 12, [M, s, "entering is_hyperbolic_filling"])
     p, q = s
-    # m, l, _ = cusp_invariants(M) [or geom_tests.cusp_invariants(M)]
-    # Computing cusp_invariants(M) is slow, so we do not do it here.
+    # The caller passes in m, l.  These could also be obtained from
+    # cusp_invariants(M), which is cached and so cheap after the first call.
     #
     # It is not clear that we should bother with the six-theorem
     if abs(p*m + q*l) > RIF( 6 ): # six-theorem
         return True
 
-    N = snappy.Manifold(M)
-    N.dehn_fill(s)
+    if N == None:
+        N = snappy.Manifold(M)
+        N.dehn_fill(s)
 
+    # One randomization per round.  We do not retry the group and
+    # hyperbolicity tests within a round: both already randomize
+    # internally (via closed_isosigs, and Nathan's retriangulations),
+    # so fresh triangulations per round give all the diversity needed.
+    # Each round gives the hyperbolicity test a little more effort.
     for i in range(tries):
-        for j in range(i+1):
-            if i > 0:
-                N.randomize()
-            is_except, reason = ft.is_exceptional_due_to_fundamental_group(N, 3, verbose)
-            if is_except:
-                verbose_print(verbose, 5, [N, "Is exceptional due to group,", reason])
-                return False
-        for j in range(1): # this is not a typo,
-            # because Nathan iterates and randomizes for us
-            if dunfield.is_hyperbolic(N, i+2, verbose): 
-                return True
+        if i > 0:
+            N.randomize()
+        is_except, reason = group_type(N, 3, verbose)
+        if is_except:
+            verbose_print(verbose, 5, [N, "Is exceptional due to group,", reason])
+            return False
+        if is_hyperbolic(N, i+2, verbose): 
+            return True
         if i > 0: # gosh, this is a tricky one... so
+            # Lens spaces are cheap to spot: finite cyclic homology and
+            # cyclic fundamental group.  No need to ask Regina.  group_type
+            # usually catches them, but not when closed_isosigs finds no
+            # small one-vertex triangulation (so it looks at no
+            # presentation at all).  The check is cached, so the
+            # wrappers below repeat it for free.
+            if rt.is_lens_space_or_sphere(N):
+                verbose_print(verbose, 5, [N, "Is a lens space"])
+                return False
             if rt.is_reducible_wrapper(N, tries, verbose)[0]:
                 return False 
             if rt.is_toroidal_wrapper(N, verbose)[0]:
                 return False 
-            name = dunfield.regina_name(N)
-            if name != None and name[:3] == 'SFS': # We trust the regina_name.
+            name = regina_name(N)
+            if name != None and name.startswith('SFS'): # We trust the regina_name.
                 return False
     return None
 
@@ -708,7 +910,8 @@ def are_distinguished_by_length_spectrum(M, s, t, check_chiral=False, cutoff = 3
     orientation-reversing isometries.
     
     The cutoff variable determines how far into the length spectrum we bother checking.
-    To save computer time, we creep up on the cutoff rather than jumping straight there.
+    To save computer time, we creep up on the cutoff rather than jumping straight there:
+    the spectra are computed up to a growing window, and prefixes of the window are compared.
     
     Returns True if the manifolds are distinguished, and False if not. 
     A True answer is only as rigorous as the length spectrum (so, not entirely).
@@ -730,26 +933,41 @@ def are_distinguished_by_length_spectrum(M, s, t, check_chiral=False, cutoff = 3
     
     norm_cutoff = 0.1 # If vector norms differ by this much, the vectors really are different
     
+    # The number of geodesics grows exponentially with length, so we
+    # do not jump straight to the cutoff.  Instead we compute the
+    # spectra up to a window, which grows by doubling steps, and compare
+    # prefixes of the window until we need more.
+    window = None
+    window_step = length_step
+    
     while current_length <= cutoff:
-        # Compute length spectra without multiplicity
-        Ms_spec = Ms_domain.length_spectrum_dicts(current_length, grouped = False)
-        Mt_spec = Mt_domain.length_spectrum_dicts(current_length, grouped = False)
-        # Throw away all but the complex lengths
-        Ms_spec = [line.length for line in Ms_spec]
-        Mt_spec = [line.length for line in Mt_spec]
+        if window == None or current_length > window:
+            if window == None:
+                window = current_length
+            else:
+                window_step = 2 * window_step
+                window = min(cutoff, window + window_step)
+            # Compute length spectra without multiplicity, and throw away all
+            # but the complex lengths.  Machine precision is plenty, since we
+            # only compare them up to norm_cutoff.
+            Ms_spec_all = np.array([complex(line.length) for line in Ms_domain.length_spectrum_dicts(window, grouped = False)], dtype = complex)
+            Mt_spec_all = np.array([complex(line.length) for line in Mt_domain.length_spectrum_dicts(window, grouped = False)], dtype = complex)
+            verbose_print(verbose, 12, [M, s, t, 'computed length spectra up to', window])
+
+        # The spectra are sorted by real length, so we just truncate
+        Ms_spec = Ms_spec_all[Ms_spec_all.real <= current_length]
+        Mt_spec = Mt_spec_all[Mt_spec_all.real <= current_length]
         
         minlen = min(len(Ms_spec), len(Mt_spec))
+        Ms_spec = Ms_spec[:minlen]
+        Mt_spec = Mt_spec[:minlen]
         
-        M_diff = [Ms_spec[i] - Mt_spec[i] for i in range(minlen)]
-        M_norm = vector(M_diff).norm()
-        
-        M_conjdiff = [Ms_spec[i] - Mt_spec[i].conjugate() for i in range(minlen)]
-        M_conjnorm = vector(M_conjdiff).norm()
+        M_norm = np.linalg.norm(Ms_spec - Mt_spec)
         
         if not(check_chiral) and M_norm > norm_cutoff:
             verbose_print(verbose, 6, [M, s, t, 'length spectrum up to', current_length, 'distinguishes oriented manifolds'])
             return True
-        if check_chiral and M_norm > norm_cutoff and M_conjnorm > norm_cutoff:
+        if check_chiral and M_norm > norm_cutoff and np.linalg.norm(Ms_spec - Mt_spec.conjugate()) > norm_cutoff:
             verbose_print(verbose, 6, [M, s, t, 'length spectrum up to', current_length, 'distinguishes un-oriented manifolds'])
             return True
         else:
@@ -759,6 +977,38 @@ def are_distinguished_by_length_spectrum(M, s, t, check_chiral=False, cutoff = 3
     return False
 
 
+def are_distinguished_by_complex_volume(Ms, Mt, prec):
+    """
+    Given two closed hyperbolic manifolds (with positive
+    triangulations), compute their verified complex volumes at the
+    given precision.  Returns True if the Chern-Simons invariants are
+    distinct (modulo pi^2/2), and False if they are too close to tell.
+    
+    This may raise an exception if the precision is too low, so usage
+    should be wrapped in a 'try'.
+    """
+    Ms_cpx_vol = Ms.complex_volume(verified_modulo_2_torsion=True, bits_prec = prec)
+    Mt_cpx_vol = Mt.complex_volume(verified_modulo_2_torsion=True, bits_prec = prec)
+    diff = Ms_cpx_vol - Mt_cpx_vol
+    # since we are here, the real part of diff is basically zero.
+    # We check that:
+    RIF = diff.real().parent()
+    eps = RIF(2**-(prec/2)) 
+    assert -eps < diff.real() < eps
+
+    # The imaginary part is, up to scale, the CS
+    # invariant.  However, it is only defined up to adding
+    # copies of i*pi^2/2.  So we need to show that the
+    # difference is not close to a multiple of i*pi^2/2.
+    diff = diff.imag()
+    RIF = diff.parent()
+    Pi = RIF(pi)
+    multiple = Pi**2 / 2
+    ratio = diff / multiple
+    frac = ratio - ratio.floor()
+    return bool(eps < frac < 1 - eps)
+
+
 def are_distinguished_by_hyp_invars(M, s, t, tries, verbose):
     """
     Given a cusped manifold M and two slopes s and t (where we think
@@ -774,60 +1024,69 @@ def are_distinguished_by_hyp_invars(M, s, t, tries, verbose):
     Mt = snappy.Manifold(M)
     Ms.dehn_fill(s)
     Mt.dehn_fill(t)
-    Ms = dunfield.find_positive_triangulation(Ms, tries) 
-    Mt = dunfield.find_positive_triangulation(Mt, tries)
+    Ms = positive_triangulation(Ms, tries) 
+    Mt = positive_triangulation(Mt, tries)
 
     if Ms == None or Mt == None:
         verbose_print(verbose, 6, [M, s, t, 'positive triangulation fail'])
         return (None, None)
     
-    prec = 40 # note the magic number 20.  Fix.
-    for i in range(tries):
+    # We do not climb a ladder of precisions.  Instead, we take a quick
+    # look at low precision, and use what we see to decide how much
+    # precision we really need.
+    # If the quick look fails, look again at higher precision: we
+    # must compare the volumes before trying Chern-Simons.
+    gap = None
+    for prec in [60, 120]:
         try:
-            # Try ordinary volume first
             Ms_vol = Ms.volume(verified=True, bits_prec = prec)
             Mt_vol = Mt.volume(verified=True, bits_prec = prec)
-
             if Ms_vol < Mt_vol or Mt_vol < Ms_vol:
                 verbose_print(verbose, 6, [M, s, t, "verified volume distinguishes at precision", prec])
                 return (True, True)
-            else:
-                verbose_print(verbose, 6, [M, s, t, "volumes very close at precision", prec])
+            gap = abs(Ms_vol - Mt_vol).center()
+            verbose_print(verbose, 6, [M, s, t, "volumes very close at precision", prec])
+            break
         except Exception as e:
             verbose_print(verbose, 6, [M, s, t, "failed to compute volume at precision", prec, str(e)])
 
-        prec = prec * 2 # seems that complex volume needs more precision than regular...
-            
+    if gap != None and gap < 1e-10:
+        # The volumes are probably equal, so only the Chern-Simons
+        # invariant can help.  It needs more precision than the volume.
+        prec = 200
         try:
-            # now try complex volume
-            Ms_cpx_vol = Ms.complex_volume(verified_modulo_2_torsion=True, bits_prec = prec)
-            Mt_cpx_vol = Mt.complex_volume(verified_modulo_2_torsion=True, bits_prec = prec)
-            diff = Ms_cpx_vol - Mt_cpx_vol
-            # since we are here, the real part of diff is basically zero.
-            # We check that:
-            RIF = diff.real().parent()
-            eps = RIF(2**-(prec/2)) 
-            assert -eps < diff.real() < eps
-
-            # The imaginary part is, up to scale, the CS
-            # invariant.  However, it is only defined up to adding
-            # copies of i*pi^2/2.  So we need to show that the
-            # difference is not close to a multiple of i*pi^2/2.
-            diff = diff.imag()
-            RIF = diff.parent()
-            Pi = RIF(pi)
-            multiple = Pi**2 / 2
-            ratio = diff / multiple
-            frac = ratio - ratio.floor()
-            if eps < frac < 1 - eps: 
+            if are_distinguished_by_complex_volume(Ms, Mt, prec):
                 verbose_print(verbose, 6, [M, s, t, 'verified complex volume distinguishes at precision', prec])
                 return (True, True)
-            else:
-                verbose_print(verbose, 6, [M, s, t, 'complex volumes very close at precision', prec])
+            verbose_print(verbose, 6, [M, s, t, 'complex volumes very close at precision', prec])
         except Exception as e:
             verbose_print(verbose, 6, [M, s, t, "failed to compute complex volume at precision", prec, str(e)])
-        
-            # Let us not randomize, since we already have a good triangulation...
+
+    # One last attempt, at a precision that should resolve the gap.
+    # (If we still know nothing about the volumes, just double.)
+    prec = 2 * prec
+    if gap != None and gap > 0:
+        prec = max(prec, int(-2 * np.log2(float(gap))) + 40)
+    try:
+        Ms_vol = Ms.volume(verified=True, bits_prec = prec)
+        Mt_vol = Mt.volume(verified=True, bits_prec = prec)
+        if Ms_vol < Mt_vol or Mt_vol < Ms_vol:
+            verbose_print(verbose, 6, [M, s, t, "verified volume distinguishes at precision", prec])
+            return (True, True)
+        verbose_print(verbose, 6, [M, s, t, "volumes very close at precision", prec])
+        gap = abs(Ms_vol - Mt_vol).center()
+    except Exception as e:
+        verbose_print(verbose, 6, [M, s, t, "failed to compute volume at precision", prec, str(e)])
+    if gap != None:
+        # Only now do we know that the volumes are close.
+        try:
+            if are_distinguished_by_complex_volume(Ms, Mt, prec):
+                verbose_print(verbose, 6, [M, s, t, 'verified complex volume distinguishes at precision', prec])
+                return (True, True)
+            verbose_print(verbose, 6, [M, s, t, 'complex volumes very close at precision', prec])
+        except Exception as e:
+            verbose_print(verbose, 6, [M, s, t, "failed to compute complex volume at precision", prec, str(e)])
+    # Let us not randomize, since we already have a good triangulation...
 
     if are_distinguished_by_length_spectrum(M, s, t, cutoff = 1.1, verbose=verbose):
         return (True, False)
@@ -23,11 +23,63 @@ from sage.rings.real_mpfr import RR
 from sage.rings.real_mpfi import RIF
 from sage.rings.rational_field import QQ
 
+from functools import lru_cache
+
 
 
 # wrappers for Regina utilities
 
 
+@lru_cache(maxsize=512)
+def _closed_isosigs_from_key(key, tries, max_tets):
+    return tuple(dunfield.closed_isosigs(snappy.Manifold(key), tries = tries, max_tets = max_tets))
+
+
+def closed_isosigs_cached(M, tries=25, max_tets=50):
+    """
+    Given a snappy Manifold M, presumed to be closed, returns
+    dunfield.closed_isosigs(M, tries, max_tets).  The answer is
+    remembered, keyed by the decorated isosig of M (which records the
+    fillings), so asking again about the same filling is free.
+    """
+    key = M.triangulation_isosig(decorated = True)
+    return list(_closed_isosigs_from_key(key, tries, max_tets))
+
+
+def clear_caches():
+    """
+    Empties the caches of closed isosigs, of lens spaces, and of
+    toroidality.
+    """
+    _closed_isosigs_from_key.cache_clear()
+    _is_toroidal_from_key.cache_clear()
+    _is_lens_space_or_sphere_from_key.cache_clear()
+
+
+def is_lens_space_or_sphere(M):
+    """
+    Given a snappy Manifold M, returns True if H_1(M) is finite cyclic
+    and SnapPy simplifies the fundamental group to at most one
+    generator.  Then M is closed, and is either S^3 or a lens space;
+    in particular M is irreducible and atoroidal.  This is cheap, so
+    try it before asking Regina.  The answer is cached, keyed by the
+    decorated isosig of M, so repeated checks on the same
+    triangulation are free.
+    """
+    return _is_lens_space_or_sphere_from_key(M.triangulation_isosig(decorated = True))
+
+
+@lru_cache(maxsize=512)
+def _is_lens_space_or_sphere_from_key(key):
+    # Homology and the group presentation are combinatorial, so there
+    # is no harm in rebuilding the manifold from its isosig.
+    M = snappy.Manifold(key)
+    divs = M.homology().elementary_divisors()
+    if len(divs) > 1 or 0 in divs:
+        return False
+    return len(M.fundamental_group().generators()) <= 1
+
+
 def is_reducible_wrapper(M, tries=10, verbose=3):
     """
     Given a snappy Manifold M, presumed to be closed, uses
@@ -35,7 +87,10 @@ def is_reducible_wrapper(M, tries=10, verbose=3):
     Returns a Boolean and the list of summands, if true.
     """
     verbose_print(verbose, 12, [M, 'entering is_reducible_wrapper'])
-    isosigs = dunfield.closed_isosigs(M, tries = 25, max_tets = 50)
+    if is_lens_space_or_sphere(M):
+        verbose_print(verbose, 12, [M, 'is S3 or a lens space, so irreducible'])
+        return (False, None)
+    isosigs = closed_isosigs_cached(M, tries = 25, max_tets = 50)
     if isosigs == []:
         return (None, None)
     T = dunfield.to_regina(isosigs[0])
@@ -59,12 +114,21 @@ def is_toroidal_wrapper(M, verbose=3):
     Returns a Boolean and a list of two pieces (not necessarily minimal).
     """    
     verbose_print(verbose, 12, [M, 'entering is_toroidal_wrapper'])
+    if is_lens_space_or_sphere(M):
+        verbose_print(verbose, 12, [M, 'is S3 or a lens space, so atoroidal'])
+        return (False, None)
+    return _is_toroidal_from_key(M.triangulation_isosig(decorated = True), verbose)
+
+
+@lru_cache(maxsize=512)
+def _is_toroidal_from_key(key, verbose):
+    M = snappy.Manifold(key)
     # We used to do this, but it is slow:
     # N = M.filled_triangulation() # this is harmless for a cusped manifold
     # T = regina.Triangulation3(N)
     if set(M.cusp_info('complete?')) == {False}: # M is closed
         verbose_print(verbose, 15, [M, 'is closed, generating isosigs'])
-        isosigs = dunfield.closed_isosigs(M, tries = 25, max_tets = 50)
+        isosigs = closed_isosigs_cached(M, tries = 25, max_tets = 50)
         if isosigs == []:
             return (None, None)
         verbose_print(verbose, 15, [M, isosigs[0]])
@@ -88,19 +152,20 @@ def torus_decomp_wrapper(M, tries=10, verbose=3):
     Compare docstring for dunfield.decompose_along_tori.
     """
     verbose_print(verbose, 12, [M, 'entering torus_decomp_wrapper'])
-    isosigs = dunfield.closed_isosigs(M, tries = 25, max_tets = 50)
+    isosigs = closed_isosigs_cached(M, tries = 25, max_tets = 50)
     if isosigs == []:
         return (None, None) # we do not continue, because the normal surface theory may be too slow.
     out = (None, None)
     verbose_print(verbose, 25, isosigs)
-    for i in range(min(len(isosigs), tries)):                                     
+    # Try at most 'tries' distinct triangulations, in order.
+    for sig in list(dict.fromkeys(isosigs))[:tries]:
         try:
-            T = dunfield.to_regina(isosigs[i])
+            T = dunfield.to_regina(sig)
             out = dunfield.decompose_along_tori(T)                                                                   
             if out[0] == True or out[0] == False:
                 break
         except Exception as e:
-            verbose_print(verbose, 6, [M, isosigs[i], e])
+            verbose_print(verbose, 6, [M, sig, e])
 
     verbose_print(verbose, 6, [M, out, 'from torus_decomp_wrapper'])
     return out